@@ -1,11 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8; py-indent-offset:4 -*-
 import numpy as np
-import pandas as pd
 from sklearn.decomposition import PCA
 
 from backtrader.strategies.porfolio_base import PortfolioBase
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, run the plain Python version
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True)
+def _top_eigen(cov, k):
+    """Top ``k`` eigenvectors (as rows) of the covariance matrix ``cov`` and
+    their explained variance ratio
+
+    Each eigenvector is signed so that its largest absolute component is
+    positive (what sklearn's PCA does from 1.5 on; older releases picked the
+    signs from U instead)
+    """
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    order = np.argsort(eigvals)[::-1][:k]
+    eigenvectors = eigvecs[:, order].T.copy()
+    for i in range(k):
+        if eigenvectors[i, np.argmax(np.abs(eigenvectors[i]))] < 0:
+            eigenvectors[i] = -eigenvectors[i]
+
+    return eigenvectors, eigvals[order] / eigvals.sum()
+
 
 class EigenPortfolio(PortfolioBase):
     """
@@ -19,12 +43,14 @@ class EigenPortfolio(PortfolioBase):
             - 'equal': 等权重分配给所有选定的特征投资组合
             - 'variance': 根据解释方差比例分配权重
             - 'first_only': 仅使用第一个特征投资组合
+        rebalance_tol (float): 新旧权重的最大差异小于该值时跳过调仓
     """
     params = (
         ('lookback', 252),         # 约一年的交易日
         ('rebalance_period', 21),  # 约一个月重新平衡一次
         ('top_eigen', 3),          # 使用前3个主成分
         ('weighting_scheme', 'variance'),  # 权重分配方案
+        ('rebalance_tol', 1e-3),   # 权重变化小于该值时跳过调仓
         ('print_debug', True),     # 是否打印调试信息
     )
 
@@ -33,71 +59,89 @@ class EigenPortfolio(PortfolioBase):
         self.addminperiod(self.p.lookback + 1)
         super().__init__()
 
+        # 按收益率矩阵(回看期 x 资产)的形状选择分解方式
+        n_assets = len(self.assets)
+        self._randomized = (n_assets > 2 * self.p.top_eigen and
+                            n_assets > self.p.lookback)
+
+        # 绑定权重方案对应的特征向量组合函数(默认仅使用第一个特征向量)
+        self._combine = {
+            'equal': lambda V, E: V.mean(axis=0),
+            'variance': lambda V, E: np.average(V, axis=0, weights=E),
+            'first_only': lambda V, E: V[0],
+        }.get(self.p.weighting_scheme, lambda V, E: V[0])
+
     def next(self):
         # 存储当前日期和投资组合价值
-        self.dates.append(self.datas[0].datetime.date(0))
-        self.portfolio_value.append(self.broker.getvalue())
+        self.record_value()
         
-        tester = len(self) - self.p.lookback
-        if (tester > 0) and (tester % self.p.rebalance_period == 1):
-            self.log(f'重新平衡投资组合，当前日期: {self.datas[0].datetime.date(0)}')
+        # record_value()已累计bar数，到达下一个调仓bar时重新平衡
+        if self._idx == self._next_rebalance:
+            self._next_rebalance += self.p.rebalance_period
+            if self.p.print_debug:
+                self.log(f'重新平衡投资组合，当前日期: {self.datas[0].datetime.date(0)}')
             self.rebalance_portfolio()
 
     def rebalance_portfolio(self):
         """重新平衡投资组合，计算特征投资组合权重"""
-        # 收集历史价格数据
-        price_data = {}
-        for asset in self.assets:
-            # 获取lookback期间的收盘价
-            prices = np.array(self.close_prices[asset].get(size=self.p.lookback+1))
-            price_data[asset] = prices
-        
-        # 创建价格DataFrame
-        price_df = pd.DataFrame(price_data)
+        # 某些数据源缺行导致历史不足一个回看窗口时，跳过本次调仓
+        size = self.p.lookback + 1
+        if any(len(line) < size for line in self.close_lines):
+            if self.p.print_debug:
+                self.log('数据不足一个回看窗口，跳过调仓')
+            return
         
-        # 计算日收益率
-        returns_df = price_df.pct_change().dropna()
+        # 回看窗口内价格缺失或非正时收益率无意义，跳过本次调仓
+        prices = self._snapshot_prices()
+        if not (np.isfinite(prices).all() and (prices > 0).all()):
+            if self.p.print_debug:
+                self.log('回看窗口内价格无效，跳过调仓')
+            return
         
         # 进行主成分分析
-        try:
-            pca = PCA(n_components=min(self.p.top_eigen, len(self.assets)))
-            pca.fit(returns_df)
-            
-            # 获取主成分(特征向量)
-            eigenvectors = pca.components_
-            
-            # 获取特征值(解释方差)
+        n_components = min(self.p.top_eigen, len(self.assets))
+        if self._randomized:
+            # 资产数远多于主成分数及样本数时，随机化截断SVD更快
+            pca = PCA(n_components=n_components,
+                      svd_solver='randomized',
+                      n_oversamples=5,
+                      random_state=0)
+            returns = (prices[:, 1:] - prices[:, :-1]) / prices[:, :-1]
+            pca.fit(returns.T)
             eigenvalues = pca.explained_variance_ratio_
             
-            # 根据权重方案分配投资组合权重
-            if self.p.weighting_scheme == 'equal':
-                # 等权重分配
-                portfolio_weights = np.mean(eigenvectors[:self.p.top_eigen], axis=0)
-            elif self.p.weighting_scheme == 'variance':
-                # 根据解释方差分配权重
-                portfolio_weights = np.average(eigenvectors[:self.p.top_eigen], 
-                                              axis=0, 
-                                              weights=eigenvalues[:self.p.top_eigen])
-            elif self.p.weighting_scheme == 'first_only':
-                # 仅使用第一个特征向量
-                portfolio_weights = eigenvectors[0]
-            else:
-                # 默认使用第一个特征向量
-                portfolio_weights = eigenvectors[0]
-            
-            # 归一化权重，使其总和为1
-            portfolio_weights = np.abs(portfolio_weights) / np.sum(np.abs(portfolio_weights))
-            
-            # 更新策略的权重字典
-            for i, asset in enumerate(self.assets):
-                self.weights[asset] = portfolio_weights[i]
-            
-            # 打印权重信息
-            self.log(f"特征投资组合权重: {dict(zip(self.assets, np.round(portfolio_weights, 4)))}")
+            # 与_top_eigen相同的符号约定，结果不依赖sklearn版本
+            eigenvectors = pca.components_
+            pivots = np.abs(eigenvectors).argmax(axis=1)
+            eigenvectors *= np.sign(
+                eigenvectors[np.arange(n_components), pivots])[:, np.newaxis]
+        else:
+            # 对收益率协方差矩阵(增量更新)做特征分解，与PCA的主方向一致
+            eigenvectors, eigenvalues = _top_eigen(self._returns_cov(),
+                                                   n_components)
+        
+        # 根据权重方案分配投资组合权重
+        portfolio_weights = self._combine(eigenvectors, eigenvalues)
+        
+        # 归一化权重，使其总和为1
+        abs_weights = np.abs(portfolio_weights, dtype=np.float64)
+        weights = abs_weights / abs_weights.sum()
+        
+        # 权重几乎没有变化时跳过调仓，避免无谓的交易成本
+        if np.max(np.abs(weights - self._weights)) < self.p.rebalance_tol:
+            if self.p.print_debug:
+                self.log('权重变化低于阈值，跳过调仓')
+            return
+        
+        self._weights = weights
+        
+        # 打印权重信息
+        if self.p.print_debug:
+            self.log('特征投资组合权重: ' +
+                     ', '.join(f'{asset}={weight:.4f}'
+                               for asset, weight in zip(self.assets,
+                                                        self._weights)))
             self.log(f"解释方差比例: {np.round(eigenvalues[:self.p.top_eigen], 4)}")
-            
-            # 执行投资组合调整
-            self.adjust_positions()
-            
-        except Exception as e:
-            self.log(f"计算特征投资组合时出错: {str(e)}")
+        
+        # 执行投资组合调整
+        self.adjust_positions()
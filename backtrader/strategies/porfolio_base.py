@@ -1,28 +1,156 @@
+import array
+
+import numpy as np
+
 import backtrader as bt
 from backtrader.order import Order
 from backtrader.trade import Trade
 
 
 class PortfolioBase(bt.Strategy):
-    def __init__(self):
-        # 存储每个数据源的收盘价
-        self.close_prices = {}
-        self.assets = []
-        
-        # 初始化每个数据源
-        for i, data in enumerate(self.datas):
-            # 获取资产名称
-            asset_name = data._name
-            self.assets.append(asset_name)
-            # 存储收盘价引用
-            self.close_prices[asset_name] = data.close
-        
+    def __init__(self, datas=None):
+        # 参与组合的数据源(默认全部)
+        datas = self.datas if datas is None else datas
+
+        # 资产名称、数据源与收盘价线按位置对齐
+        self.assets = [data._name for data in datas]
+        self._asset_datas = list(datas)
+        self.close_lines = [data.close for data in datas]
+
         # 初始化投资组合权重
-        self.weights = {asset: 0.0 for asset in self.assets}
+        self._weights = np.zeros(len(datas))
+
+        # 回看窗口价格矩阵(资产 x 回看期)
+        # 收益率/协方差计算使用float32，精度足够且数据量减半
+        self._prices = np.empty((len(datas), self.p.lookback + 1),
+                                dtype=np.float32)
+
+        # 回看窗口收益率的和与外积和，用于增量更新协方差矩阵
+        # (累加量保持float64，避免反复加减累积误差)
+        self._ret_sum = np.zeros(len(datas))
+        self._ret_ssq = np.zeros((len(datas), len(datas)))
+        self._ret_lens = None  # 上次更新时各收盘价线的长度
         
-        # 存储每日投资组合价值
-        self.portfolio_value = []
-        self.dates = []
+        # 预分配每日投资组合价值与日期数值的缓冲区(数据未预加载时按需扩容)
+        buflen = self.data.buflen()
+        self._values = np.empty(buflen, dtype=np.float64)
+        self._datenums = np.empty(buflen, dtype=np.float64)
+        self._idx = 0
+
+        # 首次调仓在回看窗口填满后的第一个bar
+        self._next_rebalance = self.p.lookback + 1
+
+    @property
+    def portfolio_value(self):
+        """Daily portfolio values recorded so far (view over the buffer)"""
+        return self._values[:self._idx]
+
+    @property
+    def dates(self):
+        """Dates matching ``portfolio_value`` as a ``datetime64[D]`` array
+
+        Only the raw datetime numbers are stored per bar, the conversion is
+        done here on request
+        """
+        dtline = self.datas[0].datetime
+        return np.array([bt.num2date(x, tz=dtline._tz).date()
+                         for x in self._datenums[:self._idx]],
+                        dtype='datetime64[D]')
+
+    def record_value(self):
+        """Store the current date and portfolio value in the buffers"""
+        if self._idx == len(self._values):
+            grow = max(len(self._values), 256)
+            self._values = np.concatenate(
+                (self._values, np.empty(grow, dtype=self._values.dtype)))
+            self._datenums = np.concatenate(
+                (self._datenums, np.empty(grow, dtype=np.float64)))
+
+        self._values[self._idx] = self.broker.getvalue()
+        self._datenums[self._idx] = self.datas[0].datetime[0]
+        self._idx += 1
+
+    def qbuffer(self, savemem=0, replaying=False):
+        super().qbuffer(savemem=savemem, replaying=replaying)
+        # exactbars > 0 时数据线只保留最少的bar，保证收盘价线能提供回看窗口
+        # 及增量更新协方差时刚移出窗口的部分
+        for line in self.close_lines:
+            line.minbuffer(2 * self.p.lookback + 1)
+
+    def _snapshot(self, lines, out, ago=0):
+        """Copy into each row of ``out`` the last ``out.shape[1]`` values of
+        the matching line in ``lines``, ending at ``ago`` (0 = current bar,
+        negative = past)"""
+        size = out.shape[1]
+        for i, line in enumerate(lines):
+            start = line.idx + ago - size + 1
+            if start < 0:
+                raise ValueError(
+                    f'{size} values ending at ago={ago} requested, but only '
+                    f'{line.idx + ago + 1} are available in the buffer')
+
+            arr = line.array
+            if isinstance(arr, array.array):
+                # 直接从底层缓冲区复制，避免逐资产生成列表
+                out[i] = np.frombuffer(arr, dtype='d', count=size,
+                                       offset=start * arr.itemsize)
+            else:  # exactbars > 0: 缓冲区为deque
+                out[i] = line.get(ago=ago, size=size)
+
+        return out
+
+    def _snapshot_prices(self, ago=0, size=None):
+        """Copy ``size`` closes (default ``lookback + 1``) of each asset,
+        ending at ``ago`` (0 = current bar, negative = past), into an
+        ``(n_assets, size)`` price matrix"""
+        if size is None:
+            out = self._prices
+        else:
+            out = np.empty((len(self.close_lines), size), dtype=np.float32)
+
+        return self._snapshot(self.close_lines, out, ago)
+
+    def _snapshot_returns(self, ago=0, size=None):
+        """Simple returns over ``size`` bars (default ``lookback``) ending at
+        ``ago`` (0 = current bar, negative = past), as an
+        ``(n_assets, size)`` matrix"""
+        prices = self._snapshot_prices(ago, None if size is None else size + 1)
+        return (prices[:, 1:] - prices[:, :-1]) / prices[:, :-1]
+
+    def _returns_cov(self):
+        """Covariance of the last ``lookback`` returns of each asset
+
+        The sums over the window are updated incrementally: only the returns
+        which entered and left the window since the previous call are added
+        and subtracted. This requires every close line to have advanced by
+        the same number of bars, else (missing bars in a feed) the window is
+        recomputed. The matrix is returned as ``float32``
+        """
+        lookback = self.p.lookback
+        lens = np.fromiter((len(line) for line in self.close_lines),
+                           dtype=np.int64, count=len(self.close_lines))
+        if self._ret_lens is None:
+            step = lookback
+        else:
+            steps = lens - self._ret_lens
+            step = steps[0] if (steps == steps[0]).all() else lookback
+
+        if step >= lookback or not np.isfinite(self._ret_ssq).all():
+            # 窗口没有可复用的部分(数据源前进不一致或含有无效值)，重新计算
+            returns = self._snapshot_returns()
+            self._ret_sum = returns.sum(axis=1, dtype=np.float64)
+            self._ret_ssq = (returns @ returns.T).astype(np.float64)
+        elif step:
+            # 加上进入窗口的收益率，减去移出窗口的收益率
+            new = self._snapshot_returns(size=step)
+            old = self._snapshot_returns(ago=-lookback, size=step)
+            self._ret_sum += new.sum(axis=1) - old.sum(axis=1)
+            self._ret_ssq += new @ new.T - old @ old.T
+
+        self._ret_lens = lens
+        mean_ssq = np.outer(self._ret_sum, self._ret_sum) / lookback
+        cov = (self._ret_ssq - mean_ssq) / (lookback - 1)
+        return cov.astype(np.float32)
 
     def log(self, txt: str, dt=None):
         """Logging function for this strategy
@@ -43,28 +171,27 @@ class PortfolioBase(bt.Strategy):
         # 获取当前投资组合总价值
         portfolio_value = self.broker.getvalue()
         
-        # 平仓所有现有头寸
-        for data in self.datas:
-            self.close(data=data)
+        # 一次性取出各资产的价格与持仓，向量化计算目标持仓数量
+        n = len(self._asset_datas)
+        prices = np.fromiter((line[0] for line in self.close_lines),
+                             dtype=np.float64, count=n)
+        positions = np.fromiter((self.getposition(data).size
+                                 for data in self._asset_datas),
+                                dtype=np.float64, count=n)
+        sizes = np.floor_divide(portfolio_value * self._weights,
+                                prices).astype(np.int64)
+        deltas = (sizes - positions) * prices
         
-        # 根据新的权重分配资金
-        for i, data in enumerate(self.datas):
-            asset_name = data._name
-            weight = self.weights[asset_name]
-            
-            if abs(weight) > 0.01:  # 忽略非常小的权重
-                # 计算目标头寸规模
-                price = data.close[0]
-                target_value = portfolio_value * weight
-                size = int(target_value / price)
-                
-                # 开仓(可以做多或做空)
-                if size > 0:
-                    self.log(f'买入 {asset_name}: {size} 股，价格: {price:.2f}')
-                    self.buy(data=data, size=size)
-                elif size < 0:
-                    self.log(f'卖空 {asset_name}: {abs(size)} 股，价格: {price:.2f}')
-                    self.sell(data=data, size=abs(size))
+        # 只调整差额超过组合价值1%的头寸，先减仓再加仓以释放资金
+        pending = np.flatnonzero(np.abs(deltas) >= 0.01 * portfolio_value)
+        for i in pending[np.argsort(deltas[pending])]:
+            data = self._asset_datas[i]
+            if self.p.print_debug:
+                action = '买入' if deltas[i] > 0 else '卖出'
+                self.log(f'{action} {data._name}: '
+                         f'{abs(sizes[i] - positions[i]):g} 股，'
+                         f'价格: {prices[i]:.2f}')
+            self.order_target_size(data=data, target=int(sizes[i]))
 
     def notify_order(self, order: Order):
         if order.status in [order.Submitted, order.Accepted]:
@@ -73,17 +200,20 @@ class PortfolioBase(bt.Strategy):
 
         # Check if an order has been completed
         # Attention: broker could reject order if not enough cash
+        # Bookkeeping always runs, messages are only built when debugging
+        debug = self.p.print_debug
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' %
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm))
+                if debug:
+                    self.log(
+                        'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' %
+                        (order.executed.price,
+                         order.executed.value,
+                         order.executed.comm))
 
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
-            else:  # Sell
+            elif debug:  # Sell
                 self.log('SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' %
                          (order.executed.price,
                           order.executed.value,
@@ -91,13 +221,14 @@ class PortfolioBase(bt.Strategy):
 
             self.bar_executed = len(self)
 
-        elif order.status in [order.Canceled, order.Margin, order.Rejected]:
+        elif debug and order.status in [order.Canceled, order.Margin,
+                                        order.Rejected]:
             self.log('Order Canceled/Margin/Rejected')
 
         self.order = None
 
     def notify_trade(self, trade: Trade):
-        if not trade.isclosed:
+        if not trade.isclosed or not self.p.print_debug:
             return
 
         self.log('OPERATION PROFIT, GROSS %.2f, NET %.2f' %
@@ -107,21 +238,20 @@ class PortfolioBase(bt.Strategy):
 class PortfolioSideInfoBase(PortfolioBase):
     def __init__(self, side_info_data_start: int):
         self.side_info_data_start = side_info_data_start
-        # 存储每个数据源的收盘价
-        self.close_prices = {}
-        self.assets = []
-        
-        # 初始化每个数据源
-        for i, data in enumerate(self.datas[:self.side_info_data_start]):
-            # 获取资产名称
-            asset_name = data._name
-            self.assets.append(asset_name)
-            # 存储收盘价引用
-            self.close_prices[asset_name] = data.close
-        
-        # 初始化投资组合权重
-        self.weights = {asset: 0.0 for asset in self.assets}
-        
-        # 存储每日投资组合价值
-        self.portfolio_value = []
-        self.dates = []
+        super().__init__(self.datas[:self.side_info_data_start])
+
+        # 辅助信息数据源的名称、收盘价线及回看窗口矩阵
+        side_datas = self.datas[self.side_info_data_start:]
+        self.side_info_assets = [data._name for data in side_datas]
+        self.side_lines = [data.close for data in side_datas]
+        self._side_info = np.empty((len(side_datas), self.p.lookback + 1))
+
+    def qbuffer(self, savemem=0, replaying=False):
+        super().qbuffer(savemem=savemem, replaying=replaying)
+        for line in self.side_lines:
+            line.minbuffer(self.p.lookback + 1)
+
+    def _snapshot_side(self):
+        """Copy the last ``lookback + 1`` values of each side info data into
+        the preallocated ``(n_side, lookback + 1)`` matrix"""
+        return self._snapshot(self.side_lines, self._side_info)
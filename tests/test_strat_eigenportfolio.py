@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import os.path
+
+import numpy as np
+from sklearn.decomposition import PCA
+
+import testcommon
+
+import backtrader as bt
+from backtrader.strategies.eigen_portfolio import EigenPortfolio, _top_eigen
+
+datafiles = [
+    'nvda-1999-2014.txt',
+    'orcl-1995-2014.txt',
+    'yhoo-1996-2014.txt',
+]
+
+FROMDATE = datetime.datetime(2012, 1, 1)
+TODATE = datetime.datetime(2014, 12, 31)
+
+
+def signed(vectors):
+    # largest absolute component of each row made positive
+    pivots = np.abs(vectors).argmax(axis=1)
+    signs = np.sign(vectors[np.arange(len(vectors)), pivots])
+    return vectors * signs[:, np.newaxis]
+
+
+def test_top_eigen():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0, 0.01, (252, 10))
+    returns += rng.normal(0.0, 0.01, (252, 1)) * np.linspace(0.5, 1.5, 10)
+
+    pca = PCA(n_components=3).fit(returns)
+    eigenvectors, eigenvalues = _top_eigen(np.cov(returns.T), 3)
+
+    # sklearn < 1.5 chose the component signs from U, normalize them
+    assert np.allclose(eigenvectors, signed(pca.components_))
+    assert np.allclose(eigenvalues, pca.explained_variance_ratio_)
+
+
+class DropEvery(object):
+    '''Removes every ``n``-th bar between ``fromdate`` and ``todate`` to
+    simulate missing rows in the data feed'''
+    def __init__(self, data, n, fromdate, todate):
+        self.n = n
+        self.fromdate = fromdate
+        self.todate = todate
+        self.count = 0
+
+    def __call__(self, data):
+        if not self.fromdate <= data.datetime.datetime(0) < self.todate:
+            return False
+
+        self.count += 1
+        if self.count % self.n:
+            return False
+
+        data.backwards()
+        return True
+
+
+class CheckCovariance(EigenPortfolio):
+    def start(self):
+        self.checks = 0
+
+    def _returns_cov(self):
+        cov = super(CheckCovariance, self)._returns_cov()
+        expected = np.cov(self._snapshot_returns())
+        assert np.abs(cov - expected).max() < 1e-4 * np.abs(expected).max()
+        self.checks += 1
+        return cov
+
+
+class CheckOrders(EigenPortfolio):
+    def start(self):
+        self.targets = []  # (asset index, target) in submission order
+        self.filtered = 0  # assets left alone by the 1% filter
+        self.skipped = 0  # rebalances skipped by rebalance_tol
+
+    def order_target_size(self, data=None, target=0, **kwargs):
+        self.targets.append((self._asset_datas.index(data), target))
+        return super(CheckOrders, self).order_target_size(
+            data=data, target=target, **kwargs)
+
+    def rebalance_portfolio(self):
+        weights = self._weights.copy()
+        norders = len(self.targets)
+        super(CheckOrders, self).rebalance_portfolio()
+        if np.array_equal(weights, self._weights):
+            self.skipped += 1
+            assert len(self.targets) == norders
+
+    def adjust_positions(self):
+        value = self.broker.getvalue()
+        expected, deltas = {}, {}
+        for i, data in enumerate(self._asset_datas):
+            price = data.close[0]
+            size = int(np.floor(value * self._weights[i] / price))
+            delta = (size - self.getposition(data).size) * price
+            if abs(delta) >= 0.01 * value:
+                expected[i], deltas[i] = size, delta
+            else:
+                self.filtered += 1
+
+        norders = len(self.targets)
+        super(CheckOrders, self).adjust_positions()
+        orders = self.targets[norders:]
+
+        # targets are floor(value * w / price), small deltas are not sent
+        assert dict(orders) == expected
+        # reductions are submitted before increases
+        submitted = [deltas[i] for i, _ in orders]
+        assert submitted == sorted(submitted)
+
+
+def getdata(datafile, fromdate=FROMDATE):
+    return bt.feeds.YahooFinanceCSVData(
+        dataname=os.path.join(testcommon.modpath, testcommon.dataspath,
+                              datafile),
+        fromdate=fromdate,
+        todate=TODATE)
+
+
+def test_run(main=False):
+    for exactbars in [False, 1]:
+        cerebro = bt.Cerebro(exactbars=exactbars)
+        for datafile in datafiles:
+            cerebro.adddata(getdata(datafile), name=datafile.split('-')[0])
+
+        cerebro.addstrategy(EigenPortfolio,
+                            lookback=60,
+                            rebalance_period=21,
+                            top_eigen=2,
+                            print_debug=main)
+        strat = cerebro.run()[0]
+
+        assert len(strat.portfolio_value) == len(strat.dates) == len(strat)
+        assert np.all(np.diff(strat.dates) > np.timedelta64(0, 'D'))
+        assert strat.dates[0] == np.datetime64('2012-01-03')
+        assert np.isclose(strat._weights.sum(), 1.0)
+        assert np.all(strat._weights > 0.0)
+
+
+def test_returns_cov(main=False):
+    # no gaps, then ORCL missing every 7th row in the first half of 2012:
+    # the window is recomputed while the feeds advance unevenly and updated
+    # incrementally again afterwards
+    for dropevery in [None, 7]:
+        cerebro = bt.Cerebro()
+        for datafile in datafiles:
+            data = getdata(datafile, fromdate=datetime.datetime(2011, 1, 1))
+            if dropevery and datafile.startswith('orcl'):
+                data.addfilter(DropEvery, n=dropevery,
+                               fromdate=datetime.datetime(2012, 1, 1),
+                               todate=datetime.datetime(2012, 7, 1))
+
+            cerebro.adddata(data, name=datafile.split('-')[0])
+
+        cerebro.addstrategy(CheckCovariance,
+                            lookback=60,
+                            rebalance_period=21,
+                            top_eigen=2,
+                            print_debug=main)
+        strat = cerebro.run()[0]
+
+        assert strat.checks > 1
+
+
+def test_short_window(main=False):
+    # ORCL missing every other row in the first half of 2012: its line holds
+    # less than a lookback window at the first rebalances, which are skipped
+    cerebro = bt.Cerebro()
+    for datafile in datafiles:
+        data = getdata(datafile)
+        if datafile.startswith('orcl'):
+            data.addfilter(DropEvery, n=2,
+                           fromdate=datetime.datetime(2012, 1, 1),
+                           todate=datetime.datetime(2012, 7, 1))
+
+        cerebro.adddata(data, name=datafile.split('-')[0])
+
+    cerebro.addstrategy(EigenPortfolio,
+                        lookback=60,
+                        rebalance_period=21,
+                        top_eigen=2,
+                        print_debug=main)
+    strat = cerebro.run()[0]
+
+    assert len(strat.datas[1]) < len(strat.datas[0])
+    assert np.isclose(strat._weights.sum(), 1.0)
+
+
+def test_orders(main=False):
+    # the larger tolerance skips some of the rebalances altogether
+    for rebalance_tol in [1e-3, 0.05]:
+        cerebro = bt.Cerebro()
+        for datafile in datafiles:
+            cerebro.adddata(getdata(datafile), name=datafile.split('-')[0])
+
+        cerebro.addstrategy(CheckOrders,
+                            lookback=60,
+                            rebalance_period=21,
+                            top_eigen=2,
+                            rebalance_tol=rebalance_tol,
+                            print_debug=main)
+        strat = cerebro.run()[0]
+
+        assert strat.targets
+        assert strat.filtered > 0
+        assert (strat.skipped > 0) == (rebalance_tol > 0.01)
+
+
+if __name__ == '__main__':
+    test_top_eigen()
+    test_run(main=True)
+    test_returns_cov(main=True)
+    test_short_window(main=True)
+    test_orders(main=True)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import os.path
+
+import numpy as np
+
+import testcommon
+
+import backtrader as bt
+from backtrader.strategies.stat_arb_portfolio import FactorStatArbPortfolio
+
+datafiles = [
+    'nvda-1999-2014.txt',
+    'orcl-1995-2014.txt',
+    'yhoo-1996-2014.txt',
+]
+
+FROMDATE = datetime.datetime(2012, 1, 1)
+TODATE = datetime.datetime(2014, 12, 31)
+
+
+class CheckSideInfo(FactorStatArbPortfolio):
+    def start(self):
+        self.checks = 0
+
+    def rebalance_portfolio(self):
+        size = self.p.lookback + 1
+        # asset prices are kept as float32, side info at full precision
+        for data, prices in zip(self.datas[:2], self._snapshot_prices()):
+            expected = np.array(data.close.get(size=size), dtype=np.float32)
+            assert np.array_equal(prices, expected)
+
+        side = self._snapshot_side()
+        assert side.shape == (1, size)
+        assert np.array_equal(side[0], self.datas[2].close.get(size=size))
+        self.checks += 1
+
+
+def test_run(main=False):
+    for exactbars in [False, 1]:
+        cerebro = bt.Cerebro(exactbars=exactbars)
+        for datafile in datafiles:
+            data = bt.feeds.YahooFinanceCSVData(
+                dataname=os.path.join(testcommon.modpath,
+                                      testcommon.dataspath, datafile),
+                fromdate=FROMDATE,
+                todate=TODATE)
+            cerebro.adddata(data, name=datafile.split('-')[0])
+
+        cerebro.addstrategy(CheckSideInfo,
+                            lookback=60,
+                            rebalance_period=21,
+                            side_info_start=2,
+                            print_debug=main)
+        strat = cerebro.run()[0]
+
+        assert strat.assets == ['nvda', 'orcl']
+        assert strat.side_info_assets == ['yhoo']
+        assert strat.checks > 1
+
+
+if __name__ == '__main__':
+    test_run(main=True)